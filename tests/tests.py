@@ -1,12 +1,42 @@
-import unittest
-from unittest.mock import patch
+import asyncio
+import importlib.machinery
+import importlib.util
 import os
+import sys
+import unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# "kls" has no .py suffix, so load it by path and inject it into sys.modules
+# instead of symlinking it into the working directory
+spec = importlib.util.spec_from_loader(
+    "kls", importlib.machinery.SourceFileLoader("kls", os.path.join(HERE, os.pardir, "kls"))
+)
+kls = importlib.util.module_from_spec(spec)
+sys.modules["kls"] = kls
+spec.loader.exec_module(kls)
+
 
-os.system("ln -s kls kls.py")
+def tearDownModule():
+    try:
+        kls.curses.endwin()
+    except kls.curses.error:
+        pass  # already ended, or stdout is not a real terminal (e.g. under a test runner)
+
+
+def make_rows_function(rows):
+    async def rows_function():
+        return list(rows)
 
-import kls
+    return rows_function
 
-os.unlink('kls.py')
+
+async def make_menu(title, rows, begin_x=0, width=20):
+    menu = kls.Menu(title, make_rows_function(rows), begin_x, width)
+    await menu.set_rows()
+    menu.set_filtered_rows()
+    return menu
 
 
 class TestCircularList(unittest.TestCase):
@@ -21,117 +51,135 @@ class TestCircularList(unittest.TestCase):
         self.circular_list.shift(-1)
         self.assertEqual(self.circular_list.index, 2)  # Since it's circular, it goes to the end
 
-    def tearDown(self):
-        kls.curses.endwin()
+    def test_reset(self):
+        self.circular_list.shift(1)
+        self.circular_list.reset(['pod1', 'pod2'])
+        self.assertEqual(self.circular_list[:2], ['pod1', 'pod2'])
+        self.assertEqual(self.circular_list.index, 0)
+
 
+class TestScriptFunctions(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        # one patch for the whole class instead of an enter/exit pair per test
+        cls.mock_exec = cls.enterClassContext(mock.patch('kls.asyncio.create_subprocess_exec', mock.AsyncMock()))
 
-class TestScriptFunctions(unittest.TestCase):
-    @patch('kls.subprocess.check_output')
-    def test_kubectl(self, mock_check_output):
-        mock_check_output.return_value = b'pod1\npod2\npod3'
-        result = kls.kubectl('get pods')
+    def setUp(self):
+        self.process = mock.AsyncMock()
+        self.mock_exec.return_value = self.process
+
+    async def test_kubectl_async(self):
+        self.process.communicate.return_value = (b'pod1\npod2\npod3', b'')
+        result = await kls.kubectl_async('get pods')
         self.assertEqual(result, ['pod1', 'pod2', 'pod3'])
 
-    def tearDown(self):
-        kls.curses.endwin()
+    async def test_kubectl_async_trailing_newline(self):
+        self.process.communicate.return_value = (b'pod1\npod2\n', b'')
+        result = await kls.kubectl_async('get pods')
+        self.assertEqual(result, ['pod1', 'pod2'])
+
+    async def test_kubectl_async_empty_output(self):
+        self.process.communicate.return_value = (b'', b'')
+        result = await kls.kubectl_async('get pods')
+        self.assertEqual(result, [''])  # callers rely on a non-empty list, like str.split
+
+    async def test_kubectl_async_error(self):
+        self.process.returncode = 1
+        self.process.communicate.return_value = (b'', b'the server could not find the requested resource')
+        with self.assertRaises(kls.subprocess.CalledProcessError):
+            await kls.kubectl_async('get nonexistent')
+
+
+class TestMenu(unittest.IsolatedAsyncioTestCase):
+    rows = ['kube-system', 'default', 'kube-public']
 
+    @classmethod
+    def setUpClass(cls):
+        cls.menu = asyncio.run(make_menu('Test', cls.rows))  # one Menu for the class, reset between tests
 
-class TestMenu(unittest.TestCase):
     def setUp(self):
-        self.rows = ['kube-system', 'default', 'kube-public']
-        self.menu = kls.Menu('Test', self.rows, 0, 10, 2)
-        self.second_menu = kls.Menu("Test Menu 2", ["pods", "services", "secrets"], 0, 10, 2)
-        self.third_menu = kls.Menu("Test Menu 3", ['pod1', 'pod2', 'pod3'], 0, 10, 2)
-        kls.menus = [self.menu, self.second_menu, self.third_menu]  # Add the menu to the list of menus
-        os.system("ln -s kls kls.py")
+        self.menu.filter = ''
+        self.menu.set_filtered_rows()
+        self.menu.visible_row_index = 0
+        self.menu.visible_rows_cache = None  # tests patch ROWS_HEIGHT, so drop the cached slice
 
     def test_menu(self):
         self.assertEqual(self.menu.title, 'Test')
-        self.assertEqual(self.menu.filtered_rows.elements, self.rows)
-        self.assertEqual(self.menu.visible_rows(), ['kube-system', 'default'])
+        self.assertEqual(list(self.menu.filtered_rows.items), self.rows)
         self.assertEqual(self.menu.selected_row(), 'kube-system')
 
+    def test_visible_rows(self):
+        with mock.patch.object(kls, 'ROWS_HEIGHT', 2):
+            self.assertEqual(self.menu.visible_rows, ['kube-system', 'default'])
+
     def test_filter_rows_with_filter(self):
-        # Apply a filter and test
         self.menu.filter = 'kube-system'
-        self.menu.filtered_rows = kls.CircularList([x for x in self.menu.rows if self.menu.filter in x])
-        self.assertEqual(self.menu.filtered_rows.elements, ['kube-system'])
+        self.menu.set_filtered_rows()
+        self.assertEqual(list(self.menu.filtered_rows.items), ['kube-system'])
 
     def test_filter_rows_with_nonexistent_filter(self):
-        # Apply a filter that matches no rows
         self.menu.filter = 'nonexistent'
-        self.menu.filtered_rows = kls.CircularList([x for x in self.menu.rows if self.menu.filter in x])
-        self.assertEqual(self.menu.filtered_rows.elements, [])
-
-    def test_vertical_navigation(self):
-        kls.selected_menu = self.menu
-        # Test moving down one row
-        kls.handle_vertical_navigation("KEY_DOWN", self.menu)
-        self.assertEqual(self.menu.visible_row_index, 0)
-
-        # Test moving up one row
-        kls.handle_vertical_navigation("KEY_UP", self.menu)
-        self.assertEqual(self.menu.visible_row_index, 0)
-
-        # Test moving to the next page
-        kls.handle_vertical_navigation("KEY_NPAGE", self.menu)
-        self.assertEqual(self.menu.visible_row_index, 0)
-
-        # Test moving to the previous page
-        kls.handle_vertical_navigation("KEY_PPAGE", self.menu)
-        self.assertEqual(self.menu.visible_row_index, 0)
-
-        # Test moving to the first row
-        kls.handle_vertical_navigation("KEY_HOME", self.menu)
-        self.assertEqual(self.menu.visible_row_index, 0)
-
-        # Test moving to the last row
-        kls.handle_vertical_navigation("KEY_END", self.menu)
-        self.assertEqual(self.menu.visible_row_index, -1)
-
-    @patch('kls.subprocess.call')
-    @patch('kls.curses.reset_prog_mode')
-    @patch('kls.curses.def_prog_mode')
-    def test_handle_key_bindings(self, mock_def_prog_mode, mock_reset_prog_mode, mock_subprocess_call):
-        namespace = self.menu.selected_row()
-        api_resource = self.second_menu.selected_row()
-        resource = self.third_menu.selected_row()
-
-        key = "1"  # Assuming you want to test the case where key is '1'
-
-        kls.handle_key_bindings(key, namespace, api_resource, resource)
-
-        mock_def_prog_mode.assert_called_once()
-        mock_reset_prog_mode.assert_called_once()
-        mock_subprocess_call.assert_called_once()
-
-    @patch('kls.curses.def_prog_mode')
-    def test_handle_key_bindings_empty_resource(self, mock_def_prog_mode):
-        namespace = self.menu.selected_row()
-        api_resource = self.second_menu.selected_row()
-        resource = None
-
-        key = "1"  # Assuming you want to test the case where key is '1'
-
-        kls.handle_key_bindings(key, namespace, api_resource, resource)
-        mock_def_prog_mode.assert_not_called()
-
-    @patch('kls.curses.def_prog_mode')
-    def test_handle_key_bindings_services(self, mock_def_prog_mode):
-        namespace = self.menu.selected_row()
-        api_resource = "services"
-        resource = self.third_menu.selected_row()
-
-        key = "4"  # 4 must not be called for services
+        self.menu.set_filtered_rows()
+        self.assertEqual(list(self.menu.filtered_rows.items), [])
+
+    async def test_filter_is_case_insensitive(self):
+        menu = await make_menu('Test', ['Kube-System', 'default'])
+        menu.filter = 'kube'
+        menu.set_filtered_rows()
+        self.assertEqual(list(menu.filtered_rows.items), ['Kube-System'])
+
+    async def test_vertical_navigation(self):
+        await kls.move_selection_vertically("KEY_DOWN", self.menu)
+        self.assertEqual(self.menu.selected_row(), 'default')
+        await kls.move_selection_vertically("KEY_UP", self.menu)
+        self.assertEqual(self.menu.selected_row(), 'kube-system')
 
-        kls.handle_key_bindings(key, namespace, api_resource, resource)
-        mock_def_prog_mode.assert_not_called()
 
-    def tearDown(self):
-        os.unlink('kls.py')  # Remove the symlink after each test
-        kls.curses.endwin()
-        print('\033[?1003l')  # Disable mouse tracking with the XTERM API
+class TestKeyBindings(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        # one set of patches for the whole class instead of an enter/exit pair per test
+        cls.mock_call = cls.enterClassContext(mock.patch.object(kls, 'subprocess_call_async', mock.AsyncMock()))
+        cls.mock_def_prog_mode = cls.enterClassContext(mock.patch.object(kls.curses, 'def_prog_mode'))
+        cls.enterClassContext(mock.patch.object(kls.curses, 'endwin'))
+        cls.enterClassContext(mock.patch.object(kls.curses, 'reset_prog_mode'))
+        cls.enterClassContext(mock.patch.object(kls, 'enable_mouse_support'))
+        cls.enterClassContext(mock.patch.object(kls, 'SCREEN'))
+        cls.menus = asyncio.run(cls.build_menus())  # built once, reinstalled per test
+
+    @staticmethod
+    async def build_menus():
+        return [
+            await make_menu('Contexts', ['kind-kind']),
+            await make_menu('Namespaces', ['default']),
+            await make_menu('API resources', ['pods', 'services', 'secrets']),
+            await make_menu('Resources', ['pod1', 'pod2', 'pod3']),
+        ]
+
+    async def asyncSetUp(self):
+        self.mock_call.reset_mock()
+        self.mock_def_prog_mode.reset_mock()
+        # restore shared module state afterwards so tests stay order- and worker-independent
+        original_menus = list(kls.MENUS)
+        self.addCleanup(lambda: kls.MENUS.__setitem__(slice(None), original_menus))
+        kls.STATE.fourth_menu_task = None
+        kls.MENUS[:] = self.menus
+
+    async def test_handle_key_bindings(self):
+        await kls.handle_key_bindings('^Y')
+        self.mock_call.assert_awaited_once()
+        self.mock_def_prog_mode.assert_called_once()
+
+    async def test_handle_key_bindings_empty_resource(self):
+        kls.MENUS[3] = await make_menu('Resources', [])
+        await kls.handle_key_bindings('^Y')
+        self.mock_def_prog_mode.assert_not_called()
+
+    async def test_handle_key_bindings_wrong_kind(self):
+        kls.MENUS[2] = await make_menu('API resources', ['services'])
+        await kls.handle_key_bindings('^L')  # logs are for pods only
+        self.mock_def_prog_mode.assert_not_called()
 
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()